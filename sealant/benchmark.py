@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+Модуль замера скорости конвейера замера утечки без Chrome.
+Записанная сессия (cdp_record в config.py) воспроизводится заглушкой ноды
+CdpStubServer, а через DevToolsProtocolConnection последовательно
+выполняются этапы одного шага замера:
+connect - подключение к ноде и подписка на события сети (activate_wait_func),
+wait - ожидание завершения загрузки (wait_full_load),
+capture - получение heapfile (get_heap_file),
+parse - парсинг heapfile с графом кучи (parsing_heap_file),
+leak_size - расчет размера кучи (get_leak_size).
+Тип heapfile определяется по записи: при наличии команды
+HeapProfiler.stopTrackingHeapObjects - таймлайн, иначе снэпшот. Для таймлайна
+границы шагов берутся из samples (last_assigned_id).
+Запуск из консоли:
+python -m sealant.benchmark cdp_records/test_case.jsonl --speed 0
+"""
+
+import argparse
+import os
+import shutil
+from time import time
+
+from sealant.cdp import DevToolsProtocolConnection
+from sealant.cdp_replay import CdpStubServer
+from sealant.config import SeaLantConfig
+from sealant.errors import NoTimeStepError
+from sealant.heapfile_processing import HeapObject
+from sealant.logger import log, set_logger
+
+conf = SeaLantConfig()
+
+
+def benchmark(record_file, speed=0,
+              time_after_last_resp=conf.time_after_last_resp):
+    """
+    Замер времени этапов конвейера на записанной сессии
+    :param record_file: путь файла записи
+    :param speed: ускорение воспроизведения, 0 - без пауз
+    :param time_after_last_resp: время ожидания после последнего
+    уникального запроса для wait_full_load, сек
+    :return: словарь {этап: время, сек}
+    """
+    stub = CdpStubServer(record_file, speed=speed)
+    stub.start()
+    timeline = any(item[1] == 'send' and
+                   item[2].get('method') == 'HeapProfiler.stopTrackingHeapObjects'
+                   for item in stub.server.record)
+    stages = {}
+
+    def stage(name, function, *args, **kwargs):
+        start = time()
+        result = function(*args, **kwargs)
+        stages[name] = time() - start
+        return result
+
+    def connect():
+        cdp.connect_to_node('http://{}'.format(stub.host), stub.port)
+        cdp.activate_wait_func()
+
+    cdp = DevToolsProtocolConnection()
+    cdp.name = 'benchmark'
+    try:
+        stage('connect', connect)
+        stage('wait', cdp.wait_full_load,
+              time_after_last_resp=time_after_last_resp)
+        heap_file = stage('capture', cdp.get_heap_file, timeline=timeline)
+    finally:
+        if cdp.started:
+            cdp.disconnect_from_node()
+        stub.stop()
+    try:
+        heap = HeapObject(heapfile=heap_file)
+        stage('parse', heap.parsing_heap_file, with_names=True,
+              with_graph=True)
+        if timeline:
+            boundaries = [last_id for _, last_id in heap.samples]
+            try:
+                stage('leak_size', heap.get_leak_size, boundaries=boundaries)
+            except NoTimeStepError as error:
+                log('Расчет таймлайна пропущен: {}'.format(error))
+        else:
+            stage('leak_size', heap.get_leak_size)
+    finally:
+        shutil.rmtree(os.path.dirname(heap_file))
+    for name, duration in stages.items():
+        log('{0}: {1:.3f} с'.format(name, duration))
+    return stages
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Замер скорости конвейера на записанной сессии CDP')
+    parser.add_argument('record_file')
+    parser.add_argument('--speed', default=0, type=float)
+    parser.add_argument('--time-after-last-resp', default=1, type=float)
+    arguments = parser.parse_args()
+    set_logger()
+    benchmark(arguments.record_file, speed=arguments.speed,
+              time_after_last_resp=arguments.time_after_last_resp)
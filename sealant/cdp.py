@@ -10,14 +10,19 @@ https://chromedevtools.github.io/devtools-protocol
 
 import json
 import pathlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from functools import partial
 from time import time, sleep
 
 import pychrome
 import requests
 
+from sealant.cdp_replay import RecordingTab
 from sealant.config import SeaLantConfig
 from sealant.logger import log
+from sealant.targets import SessionTab, TargetSession
 
 conf = SeaLantConfig()
 
@@ -38,25 +43,98 @@ class DevToolsProtocolConnection:
         self.last_response = time()   # Время последнего ответа для определения завершения сетевой активности по http
         self.requests = [set(), set()]  # [активные запросы, все вызванные методы]
         self.stats_all = [[0, 0, 0]]  # Список обновления фрагментов памяти вида [идентификатор, число объектов, размер]
+        self.heap_fragments = {}  # Текущий размер фрагментов памяти {идентификатор: размер}, не сбрасывается ожиданием
         self.started = False
         self.name = 'undefined'
+        self.grown_objects = []  # Атрибуция утечки: [имя, число объектов, размер КБ]
+        self.gc_rounds = []  # Количество вызовов GC в каждой очистке
+        self.retainer_paths = []  # Пути удержания выросших объектов от GC roots
+        self.children = {}  # Дочерние цели {sessionId: DevToolsProtocolConnection}
+        self.class_isolate = False  # Изоляция всех тестов класса в одном контексте браузера
+        self.context = None  # Контекст браузера теста/класса, BrowserContext
+        self.last_seen_object_id = 0  # Последний выданный id объекта кучи из HeapProfiler.lastSeenObjectId
+        self._last_seen_count = 0  # Количество полученных событий lastSeenObjectId
+        self._last_seen = threading.Condition()
 
     def connect_to_node(self, host, port, ws_url=''):
         """
         Подключение к ноду. Если задан адрес ws - сразу подключается к нему.
-        Иначе получаем адрес используя заданный хост/порт
+        Иначе получаем адрес используя заданный хост/порт.
+        При cdp_record в конфиге трафик пишется в cdp_records/<имя теста>.jsonl
         :param host: хост для подключения к ноде
         :param port: порт для подключения к ноде
         :param ws_url: адрес для  подключения к вебсокету ноды ws://
         """
         websocket_url = ws_url or self._websocket_debugger_url(host, port)
-        self.tab = pychrome.Tab(description='mld', id='mld', type='mld',
-                                webSocketDebuggerUrl=websocket_url)
+        if conf.cdp_record:
+            path = '{0}cdp_records/'.format(conf.path_to_save)
+            pathlib.Path(path).mkdir(parents=True, exist_ok=True)
+            self.tab = RecordingTab(
+                record_file='{0}{1}.jsonl'.format(path, self.name),
+                description='mld', id='mld', type='mld',
+                webSocketDebuggerUrl=websocket_url)
+        else:
+            self.tab = SessionTab(description='mld', id='mld', type='mld',
+                                  webSocketDebuggerUrl=websocket_url)
+        self.children = {}
         self.tab.start()
         self.started = True
         log('Подключено к ноде: {}'.format(websocket_url))
         return True
 
+    def attach_child_targets(self):
+        """
+        Автоподключение к дочерним целям ноды (Target.setAutoAttach
+        с плоскими сессиями). Подключенные цели заданных в конфиге типов
+        добавляются в self.children и участвуют в замерах через
+        for_each_target.
+        """
+        self.tab.Target.attachedToTarget = partial(self._attach_target,
+                                                   parent=self.tab)
+        self.tab.Target.detachedFromTarget = self._detach_target
+        try:
+            self.tab.Target.setAutoAttach(autoAttach=True,
+                                          waitForDebuggerOnStart=False,
+                                          flatten=True)
+        except pychrome.CallMethodException:
+            log('Нода не поддерживает подключение к дочерним целям')
+            return False
+        return True
+
+    def targets(self, detached=False):
+        """
+        :param detached: включать отключенные дочерние цели
+        :return: нода и подключенные дочерние цели
+        """
+        return [self] + [child for child in list(self.children.values())
+                         if child.started or detached]
+
+    def for_each_target(self, method, *args, **kwargs):
+        """
+        Одновременный вызов метода класса для ноды и всех дочерних целей.
+        Ошибки дочерних целей (например, цель завершилась во время вызова)
+        логируются, цель пропускается.
+        :param method: имя метода DevToolsProtocolConnection
+        :return: словарь {имя цели: результат}
+        """
+        targets = self.targets()
+        if len(targets) == 1:
+            return {self.name: getattr(self, method)(*args, **kwargs)}
+        with ThreadPoolExecutor(max_workers=len(targets)) as executor:
+            futures = [(target, executor.submit(getattr(target, method),
+                                                *args, **kwargs))
+                       for target in targets]
+        result = {}
+        for target, future in futures:
+            try:
+                result[target.name] = future.result()
+            except (pychrome.CallMethodException,
+                    pychrome.TimeoutException) as error:
+                if target is self:
+                    raise
+                log('Цель {0} пропущена: {1}'.format(target.name, error))
+        return result
+
     @staticmethod
     def _websocket_debugger_url(host, port):
         """
@@ -120,6 +198,14 @@ class DevToolsProtocolConnection:
                 result.append(metric['result']['value'])
         return result
 
+    def get_heap_usage(self):
+        """
+        Быстрый замер занятой кучи без снятия снэпшота.
+        :return: размер используемой кучи, КБ
+        """
+        heap_usage = self.tab.Runtime.getHeapUsage()
+        return heap_usage['usedSize'] / 1000
+
     def activate_wait_func(self):
         """
         Активируем домен Network и вешаем подписчиков для использования
@@ -187,6 +273,110 @@ class DevToolsProtocolConnection:
         log('Вызов GC')
         return True
 
+    def get_heap_boundary(self, timeout=conf.heap_boundary_timeout):
+        """
+        Отметка границы шага на часах кучи ноды: последний выданный id
+        объекта из события HeapProfiler.lastSeenObjectId. id выдаются
+        пачками при периодическом срезе кучи, поэтому ожидается второе
+        новое событие - первое могло быть отправлено до вызова.
+        Все объекты, созданные позже, получат больший id.
+        Требует запущенной записи heaptimeline (start_heap_tracking).
+        :param timeout: время ожидания событий, сек
+        :return: последний выданный id объекта
+        """
+        if not self.tab.get_listener('HeapProfiler.lastSeenObjectId'):
+            raise pychrome.CallMethodException(
+                'Запись heaptimeline цели {} не запущена'.format(self.name))
+        with self._last_seen:
+            count = self._last_seen_count + 2
+            if not self._last_seen.wait_for(
+                    lambda: self._last_seen_count >= count, timeout):
+                raise pychrome.TimeoutException(
+                    'Не получено событие HeapProfiler.lastSeenObjectId')
+            return self.last_seen_object_id
+
+    def start_heap_tracking(self):
+        """
+        Запуск записи heaptimeline. Нумерация фрагментов памяти начинается
+        заново, поэтому фрагменты предыдущей записи сбрасываются.
+        """
+        self.heap_fragments.clear()
+        self.tab.HeapProfiler.lastSeenObjectId = self._update_last_seen_object_id
+        self.tab.HeapProfiler.startTrackingHeapObjects()
+        return True
+
+    def settle_garbage(self, tolerance=conf.gc_settle_tolerance,
+                       max_rounds=conf.gc_settle_max_rounds):
+        """
+        Вызывает GC до сходимости занятой кучи: очистка завершается, когда
+        размер кучи после очередного вызова изменился не более чем на
+        tolerance, либо после max_rounds вызовов.
+        Количество вызовов добавляется в self.gc_rounds.
+        :param tolerance: допустимое изменение кучи, КБ
+        :param max_rounds: максимальное количество вызовов GC
+        :return: размер занятой кучи после очистки, КБ
+        """
+        heap_usage = self.get_heap_usage()
+        rounds = 0
+        while rounds < max_rounds:
+            self.tab.HeapProfiler.collectGarbage()
+            rounds += 1
+            last_heap_usage = heap_usage
+            heap_usage = self.get_heap_usage()
+            if abs(last_heap_usage - heap_usage) <= tolerance:
+                break
+        self.gc_rounds.append(rounds)
+        log('Вызов GC {0}: {1} раз, куча {2:.2f} KB'.format(self.name, rounds,
+                                                           heap_usage))
+        return heap_usage
+
+    def _attach_target(self, parent, **kwargs):
+        """
+        Обработчик подключения дочерней цели.
+        Для цели создается экземпляр класса с плоской сессией вместо вкладки,
+        имя цели: <имя теста>/<тип цели>_<номер>.
+        Вложенные цели (например, worker внутри iframe) подключаются
+        этим же обработчиком. Цели не заданных в конфиге типов отключаются.
+        :param parent: вкладка или сессия, к которой подключилась цель
+        """
+        target_info = kwargs['targetInfo']
+        if target_info['type'] not in conf.child_target_types:
+            try:
+                parent.Target.detachFromTarget(sessionId=kwargs['sessionId'])
+            except pychrome.CallMethodException:
+                pass
+            return
+        session = TargetSession(self.tab, kwargs['sessionId'], target_info)
+        self.tab.sessions[session.session_id] = session
+        child = DevToolsProtocolConnection()
+        child.tab = session
+        child.name = '{0}/{1}_{2}'.format(self.name, target_info['type'],
+                                          len(self.children) + 1)
+        session.Target.attachedToTarget = partial(self._attach_target,
+                                                  parent=session)
+        session.Target.detachedFromTarget = self._detach_target
+        try:
+            session.HeapProfiler.enable()
+            session.Target.setAutoAttach(autoAttach=True,
+                                         waitForDebuggerOnStart=False,
+                                         flatten=True)
+        except pychrome.CallMethodException:
+            pass
+        child.started = True
+        self.children[session.session_id] = child
+        log('Подключена цель {0}: {1}'.format(child.name, target_info['url']))
+
+    def _detach_target(self, **kwargs):
+        """
+        Обработчик отключения дочерней цели. Цель остается в self.children
+        для отчета, но больше не участвует в замерах.
+        """
+        child = self.children.get(kwargs['sessionId'])
+        if child:
+            child.started = False
+            self.tab.sessions.pop(kwargs['sessionId'], None)
+            log('Отключена цель {}'.format(child.name))
+
     def _update_memory_allocation(self, **kwargs):
         """
         Обработчик, получающий и обрабатывающий обновления объемов памяти,
@@ -195,8 +385,12 @@ class DevToolsProtocolConnection:
         у существующих обновляется объем занимаемой памяти.
         Сообщения состоят из триплетов:
         id фрагмента, кол-во объектов во фрагменте, объем занимаемой памяти.
+        Текущие размеры фрагментов дублируются в "self.heap_fragments"
+        для телеметрии.
         """
         stats_update = kwargs['statsUpdate']
+        for i in range(0, len(stats_update), 3):
+            self.heap_fragments[stats_update[i]] = stats_update[i + 2]
         stats = ([time(), stats_update[i], stats_update[i + 2]]
                  for i in range(0, len(stats_update), 3))
         for stat in stats:
@@ -207,6 +401,15 @@ class DevToolsProtocolConnection:
             else:
                 self.stats_all.append(stat)
 
+    def _update_last_seen_object_id(self, **kwargs):
+        """
+        Обработчик среза кучи с последним выданным id объекта
+        """
+        with self._last_seen:
+            self.last_seen_object_id = int(kwargs['lastSeenObjectId'])
+            self._last_seen_count += 1
+            self._last_seen.notify_all()
+
     def _update_sent_requests(self, **kwargs):
         """
         Обработчик http запросов.
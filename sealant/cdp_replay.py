@@ -0,0 +1,346 @@
+# -*- coding: utf-8 -*-
+"""
+Модуль записи и воспроизведения трафика Chrome DevTools Protocol.
+RecordingTab - вкладка pychrome, которая пишет все отправленные команды и
+полученные ответы/события (включая чанки heapfile) с временем относительно
+подключения в файл формата json lines: [время, "send"/"recv", сообщение].
+CdpStubServer - локальный сервер, который отдает /json и по websocket
+воспроизводит записанную сессию: ответы и события отправляются после
+получения соответствующих команд с записанными интервалами, ускоренными
+в speed раз (speed=0 - без пауз).
+Запуск сервера из консоли:
+python -m sealant.cdp_replay cdp_records/test_case.jsonl --port 9222 --speed 10
+"""
+
+import argparse
+import base64
+import hashlib
+import json
+import struct
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep, time
+
+from sealant.logger import log
+from sealant.targets import SessionTab
+
+_WS_MAGIC = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+
+class _RecordingSocket:
+    """
+    Обертка над websocket соединением pychrome, записывающая трафик
+    """
+    def __init__(self, ws, record_file):
+        """
+        :param ws: websocket соединение
+        :param record_file: путь файла записи
+        """
+        self._ws = ws
+        self._lock = threading.Lock()
+        self._start = time()
+        self._out = open(record_file, 'w', encoding='utf-8', buffering=1)
+
+    def send(self, message_json):
+        self._write('send', message_json)
+        return self._ws.send(message_json)
+
+    def recv(self):
+        message_json = self._ws.recv()
+        self._write('recv', message_json)
+        return message_json
+
+    def settimeout(self, timeout):
+        return self._ws.settimeout(timeout)
+
+    def close(self):
+        self._ws.close()
+        self.close_record()
+
+    def close_record(self):
+        with self._lock:
+            self._out.close()
+
+    def _write(self, direction, message_json):
+        with self._lock:
+            if not self._out.closed:
+                self._out.write('[{0:.6f},"{1}",{2}]\n'.format(
+                    time() - self._start, direction, message_json))
+
+
+class RecordingTab(SessionTab):
+    """
+    Вкладка с записью трафика CDP в файл
+    """
+    def __init__(self, record_file, **kwargs):
+        """
+        :param record_file: путь файла записи
+        """
+        self._record_file = record_file
+        super().__init__(**kwargs)
+
+    @property
+    def _ws(self):
+        return self._socket
+
+    @_ws.setter
+    def _ws(self, ws):
+        if ws is not None:
+            ws = _RecordingSocket(ws, self._record_file)
+        self._socket = ws
+
+    def stop(self):
+        """
+        Остановка вкладки с закрытием файла записи.
+        disconnect_from_node останавливает цикл вручную, поэтому
+        tab.stop не закрывает websocket и файл нужно закрыть явно.
+        """
+        result = super().stop()
+        if self._socket is not None:
+            self._socket.close_record()
+        return result
+
+
+def load_record(record_file):
+    """
+    Чтение файла записи
+    :param record_file: путь файла записи
+    :return: список [время, "send"/"recv", сообщение]
+    """
+    with open(record_file, encoding='utf-8') as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+class _ReplaySession:
+    """
+    Воспроизведение записи для одного websocket клиента.
+    Полученная от клиента команда сопоставляется с первой несопоставленной
+    записанной командой с тем же методом и sessionId, поэтому команды,
+    отправленные параллельно в разные цели, могут прийти в любом порядке.
+    Записанное сообщение от ноды отправляется, когда клиент прислал все
+    предшествующие ему команды и прошло записанное время от последней из них.
+    """
+    def __init__(self, record, speed, send):
+        """
+        :param record: список из load_record
+        :param speed: ускорение воспроизведения, 0 - без пауз
+        :param send: функция отправки текста клиенту
+        """
+        self.record = record
+        self.speed = speed
+        self.send = send
+        self.sends = [i for i, item in enumerate(record) if item[1] == 'send']
+        self.gate_time = [None] * len(self.sends)  # Время получения команды
+        self.matched = 0                 # Длина сопоставленного префикса команд записи
+        self.ids = {}                    # id записанной команды: id клиента
+        self.closed = False
+        self._condition = threading.Condition()
+
+    def on_command(self, message):
+        """
+        Обработка команды клиента
+        :param message: команда, dict
+        """
+        with self._condition:
+            for n in range(self.matched, len(self.sends)):
+                recorded = self.record[self.sends[n]][2]
+                if (self.gate_time[n] is None and
+                        recorded.get('method') == message.get('method') and
+                        recorded.get('sessionId') == message.get('sessionId')):
+                    self.ids[recorded['id']] = message['id']
+                    self.gate_time[n] = time()
+                    while (self.matched < len(self.sends) and
+                           self.gate_time[self.matched] is not None):
+                        self.matched += 1
+                    self._condition.notify_all()
+                    return
+        log('Команда {} отсутствует в записи'.format(message.get('method')))
+        error = {'id': message['id'], 'error': {'code': -32601,
+                                                'message': 'not recorded'}}
+        if 'sessionId' in message:
+            error['sessionId'] = message['sessionId']
+        self.send(json.dumps(error))
+
+    def play(self):
+        """
+        Цикл отправки записанных ответов и событий
+        """
+        gate = -1
+        for item in self.record:
+            if item[1] == 'send':
+                gate += 1
+                continue
+            with self._condition:
+                while gate >= self.matched and not self.closed:
+                    self._condition.wait(1)
+                if self.closed:
+                    return
+            if gate >= 0 and self.speed:
+                due = (self.gate_time[gate] +
+                       (item[0] - self.record[self.sends[gate]][0]) /
+                       self.speed)
+                if due > time():
+                    sleep(due - time())
+            message = item[2]
+            if 'id' in message:
+                if message['id'] not in self.ids:
+                    continue
+                message = dict(message, id=self.ids[message['id']])
+            self.send(json.dumps(message))
+
+    def close(self):
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    """
+    Обработчик /json и websocket подключения к заглушке ноды
+    """
+    def do_GET(self):
+        if self.headers.get('Upgrade', '').lower() == 'websocket':
+            self._websocket()
+        elif self.path.rstrip('/') in ('/json', '/json/list'):
+            host, port = self.server.server_address[:2]
+            body = json.dumps([{
+                'id': 'replay', 'type': 'page', 'title': 'replay',
+                'webSocketDebuggerUrl': 'ws://{0}:{1}/devtools/page/replay'
+                .format(host, port)}]).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self.send_error(404)
+
+    def log_message(self, *args):
+        pass
+
+    def _websocket(self):
+        key = self.headers['Sec-WebSocket-Key'] + _WS_MAGIC
+        accept = base64.b64encode(hashlib.sha1(key.encode()).digest())
+        self.send_response(101)
+        self.send_header('Upgrade', 'websocket')
+        self.send_header('Connection', 'Upgrade')
+        self.send_header('Sec-WebSocket-Accept', accept.decode())
+        self.end_headers()
+        self.wfile.flush()
+        lock = threading.Lock()
+
+        def send(text):
+            with lock:
+                try:
+                    self.connection.sendall(_ws_frame(text.encode('utf-8')))
+                except OSError:
+                    session.close()
+
+        session = _ReplaySession(self.server.record, self.server.speed, send)
+        player = threading.Thread(target=session.play, daemon=True)
+        player.start()
+        try:
+            while True:
+                opcode, payload = _ws_read_frame(self.rfile)
+                if opcode == 8 or opcode is None:
+                    break
+                if opcode == 1:
+                    session.on_command(json.loads(payload.decode('utf-8')))
+        finally:
+            session.close()
+            self.close_connection = True
+
+
+def _ws_frame(payload, opcode=1):
+    """
+    Сборка websocket фрейма сервера (без маски)
+    """
+    length = len(payload)
+    if length < 126:
+        header = struct.pack('!BB', 0x80 | opcode, length)
+    elif length < 65536:
+        header = struct.pack('!BBH', 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack('!BBQ', 0x80 | opcode, 127, length)
+    return header + payload
+
+
+def _ws_read_frame(rfile):
+    """
+    Чтение websocket фрейма клиента с учетом фрагментации
+    :return: (opcode, данные) или (None, None) при закрытии соединения
+    """
+    opcode = None
+    data = b''
+    while True:
+        header = rfile.read(2)
+        if len(header) < 2:
+            return None, None
+        fin = header[0] & 0x80
+        opcode = opcode or header[0] & 0x0f
+        length = header[1] & 0x7f
+        if length == 126:
+            length = struct.unpack('!H', rfile.read(2))[0]
+        elif length == 127:
+            length = struct.unpack('!Q', rfile.read(8))[0]
+        mask = rfile.read(4) if header[1] & 0x80 else b'\x00' * 4
+        payload = rfile.read(length)
+        data += bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+        if fin:
+            return opcode, data
+
+
+class CdpStubServer:
+    """
+    Локальная заглушка ноды, воспроизводящая записанную сессию CDP
+    """
+    def __init__(self, record_file, host='localhost', port=0, speed=1.0):
+        """
+        :param record_file: путь файла записи
+        :param host: хост сервера
+        :param port: порт сервера, 0 - свободный порт
+        :param speed: ускорение воспроизведения, 0 - без пауз
+        """
+        self.server = ThreadingHTTPServer((host, int(port)), _StubHandler)
+        self.server.daemon_threads = True
+        self.server.record = load_record(record_file)
+        self.server.speed = speed
+        self.host, self.port = self.server.server_address[:2]
+        self._thread = None
+
+    def start(self):
+        """
+        Запуск сервера в фоновом потоке
+        """
+        self._thread = threading.Thread(target=self.server.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+        log('Заглушка ноды: http://{0}:{1}'.format(self.host, self.port))
+        return True
+
+    def stop(self):
+        """
+        Остановка сервера
+        """
+        self.server.shutdown()
+        self.server.server_close()
+        return True
+
+
+if __name__ == '__main__':
+    from sealant.logger import set_logger
+    parser = argparse.ArgumentParser(description='Заглушка ноды CDP')
+    parser.add_argument('record_file')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', default=9222, type=int)
+    parser.add_argument('--speed', default=1.0, type=float)
+    arguments = parser.parse_args()
+    set_logger()
+    stub = CdpStubServer(arguments.record_file, host=arguments.host,
+                         port=arguments.port, speed=arguments.speed)
+    stub.start()
+    try:
+        while True:
+            sleep(1)
+    except KeyboardInterrupt:
+        stub.stop()
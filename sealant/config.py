@@ -12,7 +12,7 @@ class SeaLantConfig(object):
     В ответ приходит словарь, откуда достается ['result']['value']
     """
 
-    number_of_test_repeats = 5             # Количество повторов теста в течение одной проверки (для таймлайна необходимо добавить 1 прогревочный и 1 последний повтор)
+    number_of_test_repeats = 5             # Количество повторов теста в течение одной проверки (для таймлайна первый повтор прогревочный, нужно не менее 3)
     unique_header_name = 'unique_header'   # Заголовок запроса, по которому определяется уникальность метода
     host = 'http://localhost'              # Хост для подключения к ноде
     port = '9222'                          # Порт для подключения к ноде
@@ -26,6 +26,19 @@ class SeaLantConfig(object):
     save_leaked_heapfile = True            # Сохранение heapfile в случае нахождения утечки
     get_xml_table = True                   # Составление xml отчета в случае нахождения утечки
     path_to_save = ''                      # Путь сохранения архива с отчетом и heapfile, по умолчанию создается папка leaks в папке с тестом
+    gc_settle_tolerance = 10               # Допустимое изменение занятой кучи между вызовами GC для завершения очистки, КБ
+    gc_settle_max_rounds = 6               # Максимальное количество вызовов GC за одну очистку
+    heap_boundary_timeout = 5              # Ожидание события HeapProfiler.lastSeenObjectId для границы шага таймлайна, сек
+    child_targets = False                  # Замер дочерних целей (workers, iframe в отдельном процессе) вместе с нодой
+    child_target_types = ('worker', 'shared_worker', 'service_worker', 'iframe')  # Типы дочерних целей для замера
+    context_pool_size = 0                  # Количество заранее созданных контекстов браузера для изоляции тестов
+    context_url = 'about:blank'            # Адрес, открываемый во вкладке нового контекста браузера
+    telemetry = False                      # Запись телеметрии (куча, активные запросы, Performance.getMetrics) в папку telemetry
+    telemetry_interval = 0.5               # Интервал между срезами телеметрии, сек
+    telemetry_port = 0                     # Порт http сервера /metrics с последним срезом телеметрии, 0 - не запускать
+    cdp_record = False                     # Запись трафика CDP в cdp_records/<имя теста>.jsonl для воспроизведения заглушкой ноды
+    grown_objects_top = 10                 # Количество групп выросших объектов в отчете гибридного режима снэпшотов
+    retainer_paths_top = 5                 # Количество путей удержания выросших объектов в отчете об утечке
 
     # Дополнительные метрики
 
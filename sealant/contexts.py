@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+Модуль изоляции тестов в отдельных контекстах браузера.
+Через подключение к браузеру (/json/version) создается новый контекст
+(Target.createBrowserContext) со своей вкладкой (Target.createTarget),
+к которой затем подключается DevToolsProtocolConnection. После теста
+контекст удаляется вместе с кучей вкладки, перезапуск браузера не нужен.
+Пул заранее созданных контекстов убирает время их создания из теста.
+Неиспользованные контексты пула удаляются при завершении процесса.
+"""
+
+import atexit
+import json
+import threading
+from urllib.parse import urlparse
+
+import pychrome
+import requests
+from websocket import WebSocketException
+
+from sealant.config import SeaLantConfig
+from sealant.logger import log
+from sealant.targets import SessionTab
+
+conf = SeaLantConfig()
+
+_pools = {}
+
+
+class BrowserContext:
+    """
+    Созданный контекст браузера с вкладкой
+    """
+    def __init__(self, pool, context_id, target_id, websocket_url):
+        """
+        :param pool: BrowserContextPool, создавший контекст
+        :param context_id: browserContextId
+        :param target_id: targetId вкладки контекста
+        :param websocket_url: адрес ws:// для подключения к вкладке
+        """
+        self.pool = pool
+        self.context_id = context_id
+        self.target_id = target_id
+        self.websocket_url = websocket_url
+
+    def release(self):
+        """
+        Удаление контекста
+        """
+        return self.pool.release(self)
+
+
+class BrowserContextPool:
+    """
+    Пул контекстов браузера одной ноды
+    """
+    def __init__(self, host, port, size=conf.context_pool_size,
+                 url=conf.context_url):
+        """
+        :param host: хост для подключения к ноде
+        :param port: порт для подключения к ноде
+        :param size: количество заранее созданных контекстов
+        :param url: адрес, открываемый во вкладке нового контекста
+        """
+        self.host = host
+        self.port = port
+        self.size = size
+        self.url = url
+        self.browser = None
+        self.ready = []
+        self._filling = False
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Получение свободного контекста: из пула или созданием нового.
+        Пул пополняется в фоне.
+        :return: BrowserContext
+        """
+        with self._lock:
+            context = self.ready.pop(0) if self.ready else None
+            fill = bool(self.size) and not self._filling
+            if fill:
+                self._filling = True
+        if context is None:
+            context = self._create()
+        if fill:
+            threading.Thread(target=self._fill, daemon=True).start()
+        log('Тест изолирован в контексте {}'.format(context.context_id))
+        return context
+
+    def release(self, context):
+        """
+        Удаление контекста вместе с его вкладками
+        :param context: BrowserContext
+        """
+        self._connect().Target.disposeBrowserContext(
+            browserContextId=context.context_id)
+        return True
+
+    def close(self):
+        """
+        Удаление неиспользованных контекстов пула и отключение от браузера
+        """
+        with self._lock:
+            ready, self.ready = self.ready, []
+            self.size = 0
+        if self.browser is None:
+            return True
+        for context in ready:
+            try:
+                self.browser.Target.disposeBrowserContext(
+                    browserContextId=context.context_id, _timeout=5)
+            except (pychrome.PyChromeException, WebSocketException):
+                pass
+        self.browser._stopped.set()
+        self.browser.wait()
+        self.browser._ws.close()
+        self.browser = None
+        return True
+
+    def _fill(self):
+        """
+        Пополнение пула до заданного размера
+        """
+        try:
+            while True:
+                with self._lock:
+                    if len(self.ready) >= self.size:
+                        return
+                context = self._create()
+                with self._lock:
+                    self.ready.append(context)
+        finally:
+            self._filling = False
+
+    def _create(self):
+        """
+        Создание контекста с вкладкой
+        :return: BrowserContext
+        """
+        browser = self._connect()
+        context_id = browser.Target.createBrowserContext()['browserContextId']
+        target_id = browser.Target.createTarget(
+            url=self.url, browserContextId=context_id)['targetId']
+        netloc = urlparse(self._browser_url).netloc
+        websocket_url = 'ws://{0}/devtools/page/{1}'.format(netloc, target_id)
+        return BrowserContext(self, context_id, target_id, websocket_url)
+
+    def _connect(self):
+        """
+        Подключение к браузеру, одно на пул
+        :return: вкладка подключения к браузеру
+        """
+        with self._lock:
+            if self.browser is None:
+                geturl = requests.get("{0}:{1}/json/version".format(
+                    self.host, self.port))
+                self._browser_url = json.loads(
+                    geturl.content)['webSocketDebuggerUrl']
+                self.browser = SessionTab(webSocketDebuggerUrl=self._browser_url)
+                self.browser.start()
+        return self.browser
+
+
+def get_context_pool(host, port):
+    """
+    Пул контекстов для ноды, один на процесс
+    :param host: хост для подключения к ноде
+    :param port: порт для подключения к ноде
+    :return: BrowserContextPool
+    """
+    key = (host, port)
+    if key not in _pools:
+        _pools[key] = BrowserContextPool(host, port,
+                                         size=conf.context_pool_size,
+                                         url=conf.context_url)
+        atexit.register(_pools[key].close)
+    return _pools[key]
@@ -11,10 +11,26 @@ samples: ["timestamp_us","last_assigned_id"]
 временные отметки на heaptimeline. timestamp_us - время в мс,
 last_assigned_id - id последней созданной ноды кучи
 Для heapsnapshot список samples будет пустым.
+Вместо длительностей шагов для таймлайна можно задать границы шагов -
+последний выданный id объекта (HeapProfiler.lastSeenObjectId) в конце
+каждого шага. id объектов кучи выдаются нодой по возрастанию, поэтому нода
+относится к шагу по своему id.
+Для атрибуции утечки (гибридный режим снэпшотов) дополнительно читается поле
+"name" нод - индекс имени конструктора в списке strings. Для строк, кода и
+других служебных типов вместо имени используется тип ноды, например (string).
+Для поиска причин утечки heap файл можно загрузить как граф (HeapGraph):
+ноды и ребра ["type","name_or_index","to_node"] хранятся в компактных
+массивах в формате CSR с обратным индексом удерживающих ребер, что позволяет
+быстро находить кратчайший путь удержания объекта от GC roots.
 """
 
 
 import json
+import re
+from array import array
+from bisect import bisect_left
+from collections import deque
+from itertools import accumulate
 
 from sealant.errors import NoResultCalcError, NoTimeStepError
 from sealant.logger import log
@@ -32,35 +48,74 @@ class HeapObject:
         """
         self.json_file = heapfile
         self.nodes = {}
+        self.names = {}
         self.samples = []
         self.result = None
+        self.graph = None
 
-    def parsing_heap_file(self):
+    def parsing_heap_file(self, with_names=False, with_graph=False):
         """
         Парсинг json файла heaptimeline/heapsnapshot.
+        :param with_names: сохранять имена конструкторов нод в self.names
+        :param with_graph: построить граф кучи self.graph для поиска путей
+        удержания
         """
         with open(self.json_file) as file:
             timeline = json.load(file)
             nodes = timeline['nodes']
             samples = timeline['samples']
-            for i in range(len(nodes[::6])):
-                self.nodes[int(nodes[i * 6 + 2])] = int(nodes[i * 6 + 3])
+            node_fields = timeline['snapshot']['meta']['node_fields']
+            node_len = len(node_fields)
+            type_index = node_fields.index('type')
+            name_index = node_fields.index('name')
+            id_index = node_fields.index('id')
+            size_index = node_fields.index('self_size')
+            strings = timeline['strings']
+            node_types = timeline['snapshot']['meta']['node_types'][0]
+            for i in range(0, len(nodes), node_len):
+                node_id = int(nodes[i + id_index])
+                self.nodes[node_id] = int(nodes[i + size_index])
+                if with_names:
+                    node_type = node_types[nodes[i + type_index]]
+                    if node_type in ('object', 'native', 'closure'):
+                        self.names[node_id] = strings[nodes[i + name_index]]
+                    else:
+                        self.names[node_id] = '({})'.format(node_type)
             self.samples = [[int(samples[i * 2]), int(samples[i * 2 + 1])]
                             for i in range(len((samples[::2])))]
+            if with_graph:
+                self.graph = HeapGraph(timeline)
         return True
 
-    def get_leak_size(self, period_dur=''):
+    def get_leak_size(self, period_dur='', boundaries=None):
         """
         Расчет утечки по имеющимся self.nodes и self.samples
-        Для расчета с таймлайном необходимо задать period_dur
+        Для расчета с таймлайном необходимо задать boundaries или period_dur
         Для таймлайна - считается объем занятой памяти в каждый шаг,
         результат возвращается списком.
         Для снэпшота - считает общий объем занятой памяти,
         результат возвращается числом.
         :param period_dur: длительность одного шага, сек
+        :param boundaries: последние выданные id объектов на границах шагов:
+        перед первым шагом и после каждого шага, по возрастанию
         :return: результат расчета, КБ
         """
-        if self.samples:
+        if boundaries:
+            if len(boundaries) < 4:
+                raise NoTimeStepError("Количество шагов менее 3 для таймлайна")
+            if boundaries[0] <= 0 or any(
+                    last >= current for last, current
+                    in zip(boundaries, boundaries[1:])):
+                raise NoTimeStepError(
+                    "Границы шагов должны возрастать и быть больше 0: "
+                    "{}".format(boundaries))
+            log('Старт расчета heaptimeline по границам шагов')
+            result = [0] * (len(boundaries) + 1)
+            for nodes_key, size in self.nodes.items():
+                result[bisect_left(boundaries, nodes_key)] += size
+            self.result = [x / 1000 for x in result[2:-1]]
+            log('Результат {} КБ/шаг'.format(self.result))
+        elif self.samples:
             if len(period_dur) < 5:
                 raise NoTimeStepError("Количество шагов менее 5 для таймлайна")
             log('Старт расчета heaptimeline')
@@ -94,6 +149,195 @@ class HeapObject:
             log('Результат {} КБ'.format(self.result))
         return self.result
 
+    def get_grown_objects(self, base, top=10):
+        """
+        Атрибуция утечки по разнице id объектов двух снэпшотов.
+        Объекты, которых нет в базовом снэпшоте, группируются по имени
+        конструктора. Оба снэпшота должны быть распарсены с with_names=True.
+        :param base: HeapObject базового снэпшота
+        :param top: количество групп в результате
+        :return: список [имя, число объектов, размер КБ] по убыванию размера
+        """
+        grown = {}
+        for node_id, size in self.nodes.items():
+            if node_id in base.nodes:
+                continue
+            name = self.names.get(node_id, '')
+            group = grown.setdefault(name, [name, 0, 0])
+            group[1] += 1
+            group[2] += size / 1000
+        result = sorted(grown.values(), key=lambda x: x[2], reverse=True)
+        return result[:top]
+
+    def get_retainer_paths(self, node_ids, top=10):
+        """
+        Кратчайшие пути удержания от GC roots для самых больших объектов
+        из node_ids. Пути, отличающиеся только индексами элементов массивов,
+        считаются одинаковыми. Требует parsing_heap_file(with_graph=True).
+        :param node_ids: id объектов, например выросших за время теста
+        :param top: количество путей в результате
+        :return: список путей вида "Window.x -> Array[1] -> (string)"
+        """
+        paths = []
+        seen = set()
+        for node_id in sorted(node_ids, key=self.nodes.get, reverse=True):
+            path = self.graph.retainer_path(node_id)
+            key = re.sub(r'\[\d+\]', '[]', path) if path else None
+            if key and key not in seen:
+                seen.add(key)
+                paths.append(path)
+                if len(paths) >= top:
+                    break
+        return paths
+
+
+class HeapGraph:
+    """
+    Граф кучи в формате CSR.
+    Ноды хранятся по индексу (порядок в heap файле), их ребра лежат подряд
+    в массивах ребер с first_edge[i] по first_edge[i + 1]. Обратный индекс
+    retainers хранит для каждой ноды удерживающие ее ребра, он строится при
+    первом обращении к retainers. Имена нод и ребер -
+    индексы в общей таблице строк strings.
+    """
+    def __init__(self, heap):
+        """
+        :param heap: распарсенный json heaptimeline/heapsnapshot
+        """
+        meta = heap['snapshot']['meta']
+        node_fields = meta['node_fields']
+        node_len = len(node_fields)
+        edge_fields = meta['edge_fields']
+        edge_len = len(edge_fields)
+        nodes = heap['nodes']
+        edges = heap['edges']
+        self.strings = heap['strings']
+        self.node_type_names = meta['node_types'][0]
+        self.edge_type_names = meta['edge_types'][0]
+        self.node_types = array('B', nodes[node_fields.index('type')::node_len])
+        self.node_names = array('L', nodes[node_fields.index('name')::node_len])
+        self.node_ids = array('L', nodes[node_fields.index('id')::node_len])
+        self.node_sizes = array('L',
+                                nodes[node_fields.index('self_size')::node_len])
+        edge_counts = nodes[node_fields.index('edge_count')::node_len]
+        self.first_edge = array('L', accumulate([0] + edge_counts))
+        self.edge_types = array('B', edges[edge_fields.index('type')::edge_len])
+        self.edge_names = array(
+            'L', edges[edge_fields.index('name_or_index')::edge_len])
+        self.edge_to = array('L', (to_node // node_len for to_node in
+                                   edges[edge_fields.index('to_node')::edge_len]))
+        self.index_by_id = {node_id: i for i, node_id in enumerate(self.node_ids)}
+        self.first_retainer = None
+        self.parent_edge = None
+        self._indexes_by_name = None
+
+    def _build_retainers(self):
+        """
+        Построение обратного индекса удерживающих ребер подсчетом
+        """
+        node_count = len(self.node_ids)
+        counts = array('L', [0]) * (node_count + 1)
+        for to_node in self.edge_to:
+            counts[to_node + 1] += 1
+        self.first_retainer = array('L', accumulate(counts))
+        position = array('L', self.first_retainer)
+        self.retainer_edges = array('L', [0]) * len(self.edge_to)
+        self.retainer_nodes = array('L', [0]) * len(self.edge_to)
+        for node in range(node_count):
+            for edge in range(self.first_edge[node], self.first_edge[node + 1]):
+                to_node = self.edge_to[edge]
+                self.retainer_edges[position[to_node]] = edge
+                self.retainer_nodes[position[to_node]] = node
+                position[to_node] += 1
+
+    def retainers(self, index):
+        """
+        :param index: индекс ноды
+        :return: список (индекс удерживающей ноды, индекс ребра)
+        """
+        if self.first_retainer is None:
+            self._build_retainers()
+        start = self.first_retainer[index]
+        end = self.first_retainer[index + 1]
+        return list(zip(self.retainer_nodes[start:end],
+                        self.retainer_edges[start:end]))
+
+    def node_name(self, index):
+        """
+        Имя ноды: тип для строк, чисел и кода, иначе имя из heap файла
+        """
+        node_type = self.node_type_names[self.node_types[index]]
+        if node_type in ('string', 'concatenated string', 'sliced string',
+                         'number', 'bigint', 'code'):
+            return '({})'.format(node_type)
+        return self.strings[self.node_names[index]] or '({})'.format(node_type)
+
+    def edge_name(self, edge):
+        """
+        Имя ребра: имя свойства или переменной, [индекс] для элементов
+        """
+        edge_type = self.edge_type_names[self.edge_types[edge]]
+        if edge_type in ('element', 'hidden'):
+            return '[{}]'.format(self.edge_names[edge])
+        return '.{}'.format(self.strings[self.edge_names[edge]])
+
+    def objects_by_name(self, name):
+        """
+        Все объекты с заданным именем конструктора
+        :param name: имя конструктора, например HTMLDivElement
+        :return: список id объектов
+        """
+        if self._indexes_by_name is None:
+            self._indexes_by_name = {}
+            for i in range(len(self.node_ids)):
+                self._indexes_by_name.setdefault(self.node_name(i), []).append(i)
+        return [self.node_ids[i] for i in self._indexes_by_name.get(name, [])]
+
+    def _build_parents(self):
+        """
+        Обход в ширину от корня (нода 0) без слабых ребер. Для каждой
+        достижимой ноды сохраняется ребро, по которому она впервые найдена,
+        что дает кратчайшие пути удержания для всех нод за один проход.
+        """
+        weak = self.edge_type_names.index('weak')
+        self.parent_edge = array('l', [-1]) * len(self.node_ids)
+        self.parent_node = array('L', [0]) * len(self.node_ids)
+        visited = bytearray(len(self.node_ids))
+        visited[0] = 1
+        queue = deque([0])
+        while queue:
+            node = queue.popleft()
+            for edge in range(self.first_edge[node], self.first_edge[node + 1]):
+                to_node = self.edge_to[edge]
+                if visited[to_node] or self.edge_types[edge] == weak:
+                    continue
+                visited[to_node] = 1
+                self.parent_edge[to_node] = edge
+                self.parent_node[to_node] = node
+                queue.append(to_node)
+
+    def retainer_path(self, node_id):
+        """
+        Кратчайший путь удержания объекта от GC roots
+        :param node_id: id объекта
+        :return: строка пути или None, если объект недостижим
+        """
+        if self.parent_edge is None:
+            self._build_parents()
+        index = self.index_by_id.get(node_id)
+        if index is None or (index and self.parent_edge[index] < 0):
+            return None
+        path = []
+        while index:
+            parent = self.parent_node[index]
+            edge = self.parent_edge[index]
+            if parent:
+                path.append(self.node_name(parent) + self.edge_name(edge))
+            index = parent
+        path.reverse()
+        path.append(self.node_name(self.index_by_id[node_id]))
+        return ' -> '.join(path)
+
 
 def check_leak_with_timeline(result, leak_size_limit):
     """
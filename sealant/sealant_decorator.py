@@ -10,20 +10,24 @@ import pathlib
 import shutil
 import xml.etree.ElementTree as xml
 from functools import wraps
-from time import sleep, time
+
+import pychrome
+from websocket import WebSocketException
 
 from sealant.cdp import DevToolsProtocolConnection
 from sealant.config import SeaLantConfig
-from sealant.errors import LeakError
+from sealant.contexts import get_context_pool
+from sealant.errors import LeakError, NoResultCalcError, NoTimeStepError
 from sealant.heapfile_processing import HeapObject, check_leak_with_timeline
 from sealant.heapfile_processing import check_leak_with_snapshots
 from sealant.logger import log, set_logger
+from sealant.telemetry import Telemetry, start_metrics_server
 
 conf = SeaLantConfig()
 
 
 def sealant(timeline=True, host='', port='', ws='',
-            wait_func=True):
+            wait_func=True, hybrid=False, isolate=False):
     """
     Декорируемый объект может быть классом или методом.
     В случае класса устанавливаются параметры подключения к ноде для всех
@@ -43,36 +47,63 @@ def sealant(timeline=True, host='', port='', ws='',
     :param port: порт для подключения к ноде
     :param ws: адрес ws:// для подключения к ноде
     :param wait_func: активировать возможность использования метода cdp.wait_full_load
+    :param hybrid: при timeline=False - гибридный режим: полные снэпшоты
+    только после прогрева и последнего шага, на промежуточных шагах замер
+    используемой кучи
+    :param isolate: замер в новом контексте браузера, который удаляется
+    после теста. Для класса - один контекст на все тесты класса,
+    удаляется в tearDownClass. Замер идет в отдельной вкладке контекста
+    (self.cdp.context.target_id) с открытым context_url из config.py,
+    а не во вкладке selenium: тест должен сам выполнять действия в ней,
+    например через self.cdp.tab.Runtime.evaluate или Page.navigate
     """
+    if hybrid and timeline:
+        raise ValueError('Гибридный режим доступен только для снэпшотов: '
+                         'укажите timeline=False')
+
     def wrapper(obj):
         if inspect.isclass(obj):
-            return _wrapper_for_class(obj, host=host, port=port, ws=ws)
+            return _wrapper_for_class(obj, host=host, port=port, ws=ws,
+                                      isolate=isolate)
         elif inspect.isfunction(obj):
             @wraps(obj)
             def test(*args, **kwargs):
                 _wrapper_for_test(obj, timeline, host, port, ws,
-                                  wait_func, *args, **kwargs)
+                                  wait_func, hybrid, isolate, *args, **kwargs)
             return test
     return wrapper
 
 
-def _wrapper_for_class(obj, host, port, ws):
+def _wrapper_for_class(obj, host, port, ws, isolate):
     """
     Функция обработки класса в декораторе.
     :param obj: декорируемый класс
     :param host: хост для подключения к ноде
     :param port: порт для подключения к ноде
     :param ws: адрес ws:// для подключения к ноде
+    :param isolate: один контекст браузера на все тесты класса
     :return: декорируемый класс с привязанным экземпляром класса
     """
     set_logger()
     obj.cdp = conf.cdp = DevToolsProtocolConnection(host=host, port=port, ws=ws)
     conf.clear_conf_cdp = False
+    if isolate:
+        obj.cdp.class_isolate = True
+        tear_down_class = obj.__dict__.get('tearDownClass')
+
+        @classmethod
+        def release_context(cls):
+            _release_context(cls.cdp)
+            if tear_down_class:
+                tear_down_class.__func__(cls)
+            else:
+                super(obj, cls).tearDownClass()
+        obj.tearDownClass = release_context
     return obj
 
 
-def _wrapper_for_test(obj, timeline, host, port, ws, wait_func,
-                      *args, **kwargs):
+def _wrapper_for_test(obj, timeline, host, port, ws, wait_func, hybrid,
+                      isolate, *args, **kwargs):
     """
     Функция обработки теста в декораторе.
     :param obj: декорируемый тест
@@ -81,20 +112,97 @@ def _wrapper_for_test(obj, timeline, host, port, ws, wait_func,
     :param port: порт для подключения к ноде
     :param ws: адрес ws:// для подключения к ноде
     :param wait_func: активировать возможность использования метода cdp.wait_full_load
+    :param hybrid: гибридный режим снэпшотов
+    :param isolate: замер в новом контексте браузера
     """
     if conf.clear_conf_cdp:
         set_logger()
         conf.cdp = DevToolsProtocolConnection(host=host, port=port,
                                               ws=ws)
     cdp = obj.cdp = conf.cdp
+    if args and hasattr(args[0], obj.__name__):
+        args[0].cdp = cdp  # Подключение доступно в тесте как self.cdp
     cdp.name = obj.__name__
     host_name = host or cdp.class_host or conf.host
     port_num = port or cdp.class_port or conf.port
     websocket_url = ws or cdp.class_ws or conf.websocket_url or ''
-    cdp.connect_to_node(host_name, port_num, websocket_url)
-    cdp.tab.HeapProfiler.enable()
-    if wait_func:
-        cdp.activate_wait_func()
+    isolate = isolate and not cdp.class_isolate
+    if isolate or cdp.class_isolate:
+        if not cdp.context:
+            cdp.context = get_context_pool(host_name, port_num).acquire()
+        websocket_url = cdp.context.websocket_url
+    telemetry = None
+    try:
+        cdp.connect_to_node(host_name, port_num, websocket_url)
+        cdp.tab.HeapProfiler.enable()
+        if conf.child_targets:
+            cdp.attach_child_targets()
+        if wait_func or conf.telemetry:
+            cdp.activate_wait_func()
+        if conf.telemetry:
+            if conf.telemetry_port:
+                start_metrics_server(conf.telemetry_port)
+            cdp.heap_fragments = {}
+            telemetry = Telemetry(cdp, interval=conf.telemetry_interval,
+                                  timeline=timeline)
+            telemetry.start()
+        results, leak, dif_result_metrics = _measure(
+            obj, cdp, timeline, wait_func, hybrid, *args, **kwargs)
+    finally:
+        if telemetry:
+            telemetry.stop()
+        if cdp.started:
+            cdp.disconnect_from_node()
+        if isolate:
+            _release_context(cdp)
+    heap_type = 'heaptimeline' if timeline else 'heapsnapshot'
+    if leak:
+        need_zip = False
+        if conf.get_xml_table:
+            _create_xml_report(cdp, results, dif_result_metrics, heap_type)
+            need_zip = True
+        if conf.save_leaked_heapfile:
+            pathlib.Path('leaks').mkdir(parents=True, exist_ok=True)
+            path = "{0}s/{1}".format(heap_type, cdp.name)
+            heap_file_location = '{0}leaks/{1}'.format(conf.path_to_save,
+                                                       cdp.name)
+            need_zip = True
+        if need_zip:
+            shutil.make_archive(heap_file_location, format='zip', root_dir=path)
+        shutil.rmtree('{}s'.format(heap_type))
+        raise LeakError("В тесте есть утечка")
+    shutil.rmtree('{}s'.format(heap_type))
+    return True
+
+
+def _release_context(cdp):
+    """
+    Удаление контекста браузера теста/класса. Ошибка удаления (например,
+    потеряно подключение к браузеру) логируется и не заменяет собой
+    исключение теста.
+    :param cdp: экземпляр DevToolsProtocolConnection ноды
+    """
+    if not cdp.context:
+        return False
+    try:
+        cdp.context.release()
+    except (pychrome.PyChromeException, WebSocketException) as error:
+        log('Контекст {0} не удален: {1}'.format(cdp.context.context_id,
+                                                  error))
+    cdp.context = None
+    return True
+
+
+def _measure(obj, cdp, timeline, wait_func, hybrid, *args, **kwargs):
+    """
+    Замер утечки с перепроверками найденной утечки.
+    :param obj: декорируемый тест
+    :param cdp: экземпляр DevToolsProtocolConnection ноды
+    :param timeline: если False - проверка с помощью снэпшотов
+    :param wait_func: активировать возможность использования метода cdp.wait_full_load
+    :param hybrid: гибридный режим снэпшотов
+    :return: (результаты по целям, наличие утечки, изменения метрик за шаг)
+    """
     measure_repeat = conf.measure_repeat + 1
     step_repeat = conf.number_of_test_repeats
     heap_type = 'heaptimeline' if timeline else 'heapsnapshot'
@@ -105,15 +213,25 @@ def _wrapper_for_test(obj, timeline, host, port, ws, wait_func,
                                     step_repeat, heap_type))
         result_metric = []
         dif_result_metrics = []
+        for target in cdp.targets(detached=True):
+            target.grown_objects = []
+            target.gc_rounds = []
+            target.retainer_paths = []
         result_metric.append(cdp.get_metrics())
         if timeline:
-            result = _meas_timeline(obj, step_repeat, wait_func,
-                                    *args, **kwargs)
+            results = _meas_timeline(obj, step_repeat, wait_func,
+                                     *args, **kwargs)
+        elif hybrid:
+            results = _meas_hybrid(obj, step_repeat, *args, **kwargs)
         else:
-            result = _meas_snapshot(obj, step_repeat,
-                                    *args, **kwargs)
-        leaksize, leak = result
+            results = _meas_snapshot(obj, step_repeat,
+                                     *args, **kwargs)
+        leaksize, leak = results[cdp.name]
         log('Leak is {:.2f} KB'.format(leaksize))
+        for name, (target_leaksize, target_leak) in results.items():
+            if name != cdp.name:
+                log('Leak in {0} is {1:.2f} KB'.format(name, target_leaksize))
+                leak = leak or target_leak
         if result_metric[0]:
             result_metric.append(cdp.get_metrics())
             for j in range(len(result_metric)):
@@ -124,55 +242,65 @@ def _wrapper_for_test(obj, timeline, host, port, ws, wait_func,
         if not leak:
             break
         step_repeat += 2
-    cdp.disconnect_from_node()
-    if leak:
-        need_zip = False
-        if conf.get_xml_table:
-            _create_xml_report(cdp, leaksize, dif_result_metrics, heap_type)
-            need_zip = True
-        if conf.save_leaked_heapfile:
-            pathlib.Path('leaks').mkdir(parents=True, exist_ok=True)
-            path = "{0}s/{1}".format(heap_type, cdp.name)
-            heap_file_location = '{0}leaks/{1}'.format(conf.path_to_save,
-                                                       cdp.name)
-            need_zip = True
-        if need_zip:
-            shutil.make_archive(heap_file_location, format='zip', root_dir=path)
-        shutil.rmtree('{}s'.format(heap_type))
-        raise LeakError("В тесте есть утечка")
-    shutil.rmtree('{}s'.format(heap_type))
-    return True
+    return results, leak, dif_result_metrics
 
 
 def _meas_timeline(decorated_function, step_repeat, wait_func,
                    *args, **kwargs):
     """
     Замер утечки с использованием таймлайна.
-    Количество повторов тестируемой функции увеличивается на 2:
-    добавляются прогревочный и завершающий шаги
+    Границы шагов отмечаются последним выданным id объекта на часах кучи
+    ноды, первый шаг считается прогревочным и не учитывается. Цель, для
+    которой получены не все границы (пропустила шаг или подключилась
+    в середине замера), исключается из расчета.
     :param decorated_function: тестируемая функция
     :param step_repeat: количество повторов тестируемой функции
     :param args: аргументы тестируемой функции
     :param kwargs: аргументы тестируемой функции
-    :return: (размер утечки в шаге в КБ, наличие утечки boolean)
+    :return: {имя цели: (размер утечки в шаге в КБ, наличие утечки boolean)}
     """
     cdp = conf.cdp
-    cdp.tab.HeapProfiler.startTrackingHeapObjects()
-    time_of_steps = []
-    for i in range(step_repeat):
-        start_step = time()
-        sleep(0.1)
-        decorated_function(*args, **kwargs)
-        if conf.default_wait_full_load and wait_func:
-            cdp.wait_full_load()
-        cdp.twice_collect_garbage()
-        time_of_steps.append(time() - start_step)
-    heap_file = cdp.get_heap_file(timeline=True)
-    heap_calc = HeapObject(heapfile=heap_file)
-    heap_calc.parsing_heap_file()
-    result = heap_calc.get_leak_size(period_dur=time_of_steps)
-    return check_leak_with_timeline(result=result,
-                                    leak_size_limit=conf.leak_size_limit)
+    cdp.for_each_target('start_heap_tracking')
+    step_boundaries = {}  # {имя цели: {номер границы: id}}
+    for i in range(step_repeat + 1):
+        if i:
+            decorated_function(*args, **kwargs)
+            if conf.default_wait_full_load and wait_func:
+                cdp.wait_full_load()
+            cdp.for_each_target('settle_garbage')
+        for name, boundary in cdp.for_each_target('get_heap_boundary').items():
+            step_boundaries.setdefault(name, {})[i] = boundary
+    heap_files = cdp.for_each_target('get_heap_file', timeline=True)
+    boundaries = {}
+    for name, target_boundaries in step_boundaries.items():
+        if len(target_boundaries) == step_repeat + 1:
+            boundaries[name] = [target_boundaries[i]
+                                for i in range(step_repeat + 1)]
+        else:
+            log('Цель {0} пропущена при расчете: получено границ шагов '
+                '{1} из {2}'.format(name, len(target_boundaries),
+                                    step_repeat + 1))
+
+    def calc(target_data):
+        heap_file, target_boundaries = target_data
+        heap_calc = HeapObject(heapfile=heap_file)
+        heap_calc.parsing_heap_file()
+        result = heap_calc.get_leak_size(boundaries=target_boundaries)
+        return check_leak_with_timeline(result=result,
+                                        leak_size_limit=conf.leak_size_limit)
+    target_data = {name: (heap_file, boundaries[name])
+                   for name, heap_file in heap_files.items()
+                   if name in boundaries}
+    results = _calc_targets(cdp, calc, target_data)
+    for target in _leaked_targets(cdp, results):
+        heap_calc = HeapObject(heapfile=heap_files[target.name])
+        heap_calc.parsing_heap_file(with_graph=True)
+        first_id = boundaries[target.name][1]
+        last_id = boundaries[target.name][-1]
+        _set_retainer_paths(target, heap_calc,
+                            [node_id for node_id in heap_calc.nodes
+                             if first_id < node_id <= last_id])
+    return results
 
 
 def _meas_snapshot(decorated_function, step_repeat, *args, **kwargs):
@@ -183,32 +311,135 @@ def _meas_snapshot(decorated_function, step_repeat, *args, **kwargs):
     :param step_repeat: количество повторов тестируемой функции
     :param args: аргументы тестируемой функции
     :param kwargs: аргументы тестируемой функции
-    :return: (размер утечки в шаге в КБ, наличие утечки boolean)
+    :return: {имя цели: (размер утечки в шаге в КБ, наличие утечки boolean)}
     """
     cdp = conf.cdp
-    heap_files = []
-    results = []
+    heap_files = {}
     for i in range(step_repeat):
         decorated_function(*args, **kwargs)
-        cdp.twice_collect_garbage()
-        heap_files.append(cdp.get_heap_file(timeline=False))
-    for heap_file in heap_files:
-        heap_calc = HeapObject(heapfile=heap_file)
-        heap_calc.parsing_heap_file()
-        results.append(heap_calc.get_leak_size())
-    result = check_leak_with_snapshots(result=results,
-                                       leak_size_limit=conf.leak_size_limit)
-    return result
+        cdp.for_each_target('settle_garbage')
+        step_files = cdp.for_each_target('get_heap_file', timeline=False)
+        for name, heap_file in step_files.items():
+            heap_files.setdefault(name, []).append(heap_file)
+
+    def calc(target_files):
+        results = []
+        for heap_file in target_files:
+            heap_calc = HeapObject(heapfile=heap_file)
+            heap_calc.parsing_heap_file()
+            results.append(heap_calc.get_leak_size())
+        return check_leak_with_snapshots(result=results,
+                                         leak_size_limit=conf.leak_size_limit)
+    results = _calc_targets(cdp, calc, heap_files)
+    for target in _leaked_targets(cdp, results):
+        base_calc = HeapObject(heapfile=heap_files[target.name][0])
+        base_calc.parsing_heap_file()
+        last_calc = HeapObject(heapfile=heap_files[target.name][-1])
+        last_calc.parsing_heap_file(with_graph=True)
+        _set_retainer_paths(target, last_calc,
+                            [node_id for node_id in last_calc.nodes
+                             if node_id not in base_calc.nodes])
+    return results
 
 
-def _create_xml_report(cdp, leaksize, dif_result_metrics, heap_type):
+def _meas_hybrid(decorated_function, step_repeat, *args, **kwargs):
+    """
+    Замер утечки в гибридном режиме снэпшотов.
+    Полный снэпшот снимается только после прогревочного и последнего шагов.
+    Для аппроксимации на каждом шаге после GC замеряется используемая куча,
+    а при найденной утечке разница id объектов двух снэпшотов дает
+    атрибуцию выросших объектов (grown_objects цели) и их пути удержания.
+    :param decorated_function: тестируемая функция
+    :param step_repeat: количество повторов тестируемой функции
+    :param args: аргументы тестируемой функции
+    :param kwargs: аргументы тестируемой функции
+    :return: {имя цели: (размер утечки в шаге в КБ, наличие утечки boolean)}
+    """
+    cdp = conf.cdp
+    decorated_function(*args, **kwargs)
+    heap_usages = {name: [heap_usage] for name, heap_usage
+                   in cdp.for_each_target('settle_garbage').items()}
+    base_files = cdp.for_each_target('get_heap_file', timeline=False)
+    for i in range(step_repeat):
+        decorated_function(*args, **kwargs)
+        for name, heap_usage in cdp.for_each_target('settle_garbage').items():
+            heap_usages.setdefault(name, []).append(heap_usage)
+    last_files = cdp.for_each_target('get_heap_file', timeline=False)
+
+    def calc(results):
+        return check_leak_with_snapshots(result=results,
+                                         leak_size_limit=conf.leak_size_limit)
+    results = _calc_targets(cdp, calc, heap_usages)
+    for target in _leaked_targets(cdp, results):
+        if not (target.name in base_files and target.name in last_files):
+            continue
+        base_calc = HeapObject(heapfile=base_files[target.name])
+        base_calc.parsing_heap_file(with_names=True)
+        last_calc = HeapObject(heapfile=last_files[target.name])
+        last_calc.parsing_heap_file(with_names=True, with_graph=True)
+        target.grown_objects = last_calc.get_grown_objects(
+            base_calc, top=conf.grown_objects_top)
+        for name, count, size in target.grown_objects:
+            log('Выросло {0}: {1} шт, {2:.2f} KB'.format(name, count, size))
+        _set_retainer_paths(target, last_calc,
+                            [node_id for node_id in last_calc.nodes
+                             if node_id not in base_calc.nodes])
+    return results
+
+
+def _calc_targets(cdp, calc, target_data):
+    """
+    Расчет утечки отдельно для каждой цели.
+    Ошибка расчета ноды пробрасывается, дочерняя цель с недостаточными
+    данными (например, подключилась в середине замера) пропускается.
+    :param cdp: экземпляр DevToolsProtocolConnection ноды
+    :param calc: функция расчета (размер утечки, наличие утечки) по данным цели
+    :param target_data: словарь {имя цели: данные для расчета}
+    :return: {имя цели: (размер утечки в шаге в КБ, наличие утечки boolean)}
+    """
+    results = {}
+    for name, data in target_data.items():
+        try:
+            results[name] = calc(data)
+        except (ValueError, KeyError, NoTimeStepError,
+                NoResultCalcError) as error:
+            if name == cdp.name:
+                raise
+            log('Цель {0} пропущена при расчете: {1}'.format(name, error))
+    return results
+
+
+def _leaked_targets(cdp, results):
+    """
+    :param cdp: экземпляр DevToolsProtocolConnection ноды
+    :param results: {имя цели: (размер утечки, наличие утечки)}
+    :return: цели, в которых найдена утечка
+    """
+    return [target for target in cdp.targets(detached=True)
+            if results.get(target.name, (0, False))[1]]
+
+
+def _set_retainer_paths(target, heap_calc, grown_ids):
+    """
+    Поиск кратчайших путей удержания самых больших выросших объектов
+    для отчета об утечке.
+    :param target: экземпляр DevToolsProtocolConnection цели
+    :param heap_calc: HeapObject, распарсенный с with_graph=True
+    :param grown_ids: id объектов, созданных во время замера
+    """
+    target.retainer_paths = heap_calc.get_retainer_paths(
+        grown_ids, top=conf.retainer_paths_top)
+    for path in target.retainer_paths:
+        log('Путь удержания в {0}: {1}'.format(target.name, path))
+
+
+def _create_xml_report(cdp, results, dif_result_metrics, heap_type):
     root = xml.Element("root")
     main_report = xml.Element("LeakReport")
     root.append(main_report)
     name_report = xml.SubElement(main_report, "TestName")
     name_report.text = cdp.name
-    leak_report = xml.SubElement(main_report, "LeakSize")
-    leak_report.text = 'Утечка за шаг: {:.2f} KB'.format(leaksize)
+    _append_target_report(main_report, cdp, results[cdp.name][0])
     if dif_result_metrics:
         metric_report = []
         for i, dif in enumerate(dif_result_metrics):
@@ -216,9 +447,39 @@ def _create_xml_report(cdp, leaksize, dif_result_metrics, heap_type):
                 xml.SubElement(main_report, 'Metric_{}'.format(i + 1)))
             metric_report[i].text = "Добавлено {0}/шаг: {1}".format(dif[1],
                                                                     dif[0])
+    for target in cdp.targets(detached=True)[1:]:
+        if target.name not in results:
+            continue
+        target_report = xml.SubElement(main_report, 'Target')
+        target_report.set('name', target.name)
+        target_report.set('type', target.tab.target_info['type'])
+        target_report.set('url', target.tab.target_info['url'])
+        _append_target_report(target_report, target, results[target.name][0])
     heap_file_report = xml.SubElement(main_report, 'HeapFile')
     heap_file_report.text = "Cохранение heapfile: {}".format(
         conf.save_leaked_heapfile)
     tree = xml.ElementTree(root)
     with open('{0}s/{1}/report.xml'.format(heap_type, cdp.name), 'wb') as fh:
         tree.write(fh, xml_declaration=True, encoding='utf-8')
+
+
+def _append_target_report(report, target, leaksize):
+    """
+    Добавление в отчет размера утечки, выросших объектов, путей удержания
+    и вызовов GC цели
+    :param report: элемент отчета
+    :param target: экземпляр DevToolsProtocolConnection цели
+    :param leaksize: размер утечки в шаге, КБ
+    """
+    leak_report = xml.SubElement(report, "LeakSize")
+    leak_report.text = 'Утечка за шаг: {:.2f} KB'.format(leaksize)
+    for i, grown in enumerate(target.grown_objects):
+        grown_report = xml.SubElement(report, 'GrownObject_{}'.format(i + 1))
+        grown_report.text = "{0}: {1} шт, {2:.2f} KB".format(*grown)
+    for i, path in enumerate(target.retainer_paths):
+        path_report = xml.SubElement(report, 'RetainerPath_{}'.format(i + 1))
+        path_report.text = path
+    if target.gc_rounds:
+        gc_report = xml.SubElement(report, 'GcRounds')
+        gc_report.text = "Вызовов GC за шаг: {}".format(
+            ', '.join(str(rounds) for rounds in target.gc_rounds))
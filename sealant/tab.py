@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+"""
+Вкладка pychrome, безопасная для вызова команд из нескольких потоков.
+Стандартный pychrome.Tab присваивает id команды без блокировки, поэтому при
+одновременных вызовах (телеметрия, параллельный замер целей) две команды
+могут получить один id, и ответ попадет не тому вызову.
+"""
+
+import threading
+
+import pychrome
+
+
+class ThreadSafeTab(pychrome.Tab):
+    """
+    Вкладка pychrome с присвоением id команд под блокировкой
+    """
+    def __init__(self, **kwargs):
+        self._id_lock = threading.Lock()
+        super().__init__(**kwargs)
+
+    def _send(self, message, timeout=None):
+        if 'id' not in message:
+            with self._id_lock:
+                self._cur_id += 1
+                message['id'] = self._cur_id
+        return super()._send(message, timeout=timeout)
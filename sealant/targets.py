@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Модуль работы с дочерними целями ноды (Web/Service Workers, iframe в
+отдельном процессе) через плоские сессии Target.setAutoAttach(flatten=True).
+Команды дочерней цели отправляются по общему websocket вкладки с полем
+sessionId, события с sessionId направляются обработчикам этой сессии.
+"""
+
+import queue
+import warnings
+
+import pychrome
+from pychrome.tab import GenericAttr, logger
+
+from sealant.tab import ThreadSafeTab
+
+
+class SessionTab(ThreadSafeTab):
+    """
+    Вкладка pychrome с поддержкой плоских сессий дочерних целей
+    """
+    def __init__(self, **kwargs):
+        self.sessions = {}  # {sessionId: TargetSession}
+        super().__init__(**kwargs)
+
+    def _handle_event_loop(self):
+        """
+        Цикл обработки событий: события с sessionId передаются
+        обработчикам соответствующей дочерней сессии. События неизвестных
+        и отключенных сессий отбрасываются.
+        """
+        while not self._stopped.is_set():
+            try:
+                event = self.event_queue.get(timeout=1)
+            except queue.Empty:
+                continue
+            if 'sessionId' in event:
+                receiver = self.sessions.get(event['sessionId'])
+            else:
+                receiver = self
+            handler = receiver and receiver.event_handlers.get(event['method'])
+            if handler:
+                try:
+                    handler(**event['params'])
+                except Exception:
+                    logger.error(
+                        "callback %s exception" % event['method'],
+                        exc_info=True)
+            self.event_queue.task_done()
+
+
+class TargetSession:
+    """
+    Плоская сессия дочерней цели с интерфейсом вкладки pychrome:
+    self.tab.HeapProfiler.collectGarbage() и подписка на события работают
+    так же, как для основной вкладки.
+    """
+    def __init__(self, tab, session_id, target_info):
+        """
+        :param tab: SessionTab, через которую подключена цель
+        :param session_id: sessionId из Target.attachedToTarget
+        :param target_info: targetInfo из Target.attachedToTarget
+        """
+        self.event_handlers = {}
+        self.tab = tab
+        self.session_id = session_id
+        self.target_info = target_info
+
+    def __getattr__(self, item):
+        attr = GenericAttr(item, self)
+        setattr(self, item, attr)
+        return attr
+
+    def call_method(self, _method, *args, **kwargs):
+        if args:
+            raise pychrome.CallMethodException(
+                "the params should be key=value format")
+        timeout = kwargs.pop("_timeout", None)
+        result = self.tab._send({"method": _method, "params": kwargs,
+                                 "sessionId": self.session_id},
+                                timeout=timeout)
+        if 'result' not in result and 'error' in result:
+            warnings.warn("%s error: %s" % (_method,
+                                            result['error']['message']))
+            raise pychrome.CallMethodException(
+                "calling method: %s error: %s" % (_method,
+                                                  result['error']['message']))
+        return result['result']
+
+    def set_listener(self, event, callback):
+        if not callback:
+            return self.event_handlers.pop(event, None)
+        self.event_handlers[event] = callback
+        return True
+
+    def get_listener(self, event):
+        return self.event_handlers.get(event, None)
+
+    def del_all_listeners(self):
+        self.event_handlers = {}
+        return True
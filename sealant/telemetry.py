@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+Модуль телеметрии во время выполнения теста.
+С заданным интервалом снимается срез живых данных подключения к ноде:
+объем кучи, количество активных запросов (Network) и значения
+Performance.getMetrics. При записи таймлайна объем кучи - сумма фрагментов
+памяти из HeapProfiler.heapStatsUpdate (столбец heap_fragments, байт).
+В режимах снэпшотов эти события не приходят, поэтому вместо него снимается
+Runtime.getHeapUsage (столбец heap_usage, КБ).
+Срезы сохраняются по столбцам в json файл telemetry/<имя теста>.json,
+последний срез можно отдавать по http в формате prometheus (/metrics).
+"""
+
+import json
+import pathlib
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from time import time
+
+import pychrome
+
+from sealant.config import SeaLantConfig
+from sealant.logger import log
+
+conf = SeaLantConfig()
+
+_metrics_server = None
+_last_sample = {}
+
+
+class Telemetry:
+    """
+    Класс записи временного ряда телеметрии одного теста
+    """
+    def __init__(self, cdp, interval=conf.telemetry_interval, timeline=True):
+        """
+        :param cdp: экземпляр DevToolsProtocolConnection
+        :param interval: интервал между срезами, сек
+        :param timeline: идет запись таймлайна - объем кучи берется из
+        фрагментов памяти, иначе из Runtime.getHeapUsage
+        """
+        self.cdp = cdp
+        self.interval = interval
+        self.timeline = timeline
+        self.heap_column = 'heap_fragments' if timeline else 'heap_usage'
+        self.columns = {'time': [], self.heap_column: [], 'requests': []}
+        self._performance = True
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """
+        Запуск фонового снятия срезов
+        """
+        try:
+            self.cdp.tab.Performance.enable()
+        except pychrome.CallMethodException:
+            self._performance = False
+        self._start_time = time()
+        self._thread = threading.Thread(target=self._sample_loop, daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        """
+        Остановка снятия срезов и запись файла
+        :return: путь к файлу телеметрии
+        """
+        self._stopped.set()
+        self._thread.join()
+        path = '{0}telemetry/'.format(conf.path_to_save)
+        pathlib.Path(path).mkdir(parents=True, exist_ok=True)
+        file_name = '{0}{1}.json'.format(path, self.cdp.name)
+        with open(file_name, 'w') as file:
+            json.dump({'test': self.cdp.name, 'interval': self.interval,
+                       'columns': self.columns}, file,
+                      separators=(',', ':'))
+        log('Телеметрия сохранена: {}'.format(file_name))
+        return file_name
+
+    def _sample_loop(self):
+        """
+        Цикл снятия срезов до вызова stop
+        """
+        while not self._stopped.is_set():
+            self._sample()
+            self._stopped.wait(self.interval)
+
+    def _sample(self):
+        """
+        Снятие одного среза. Столбцы метрик Performance добавляются
+        по мере появления, пропущенные значения заполняются None.
+        """
+        sample = {'time': round(time() - self._start_time, 3)}
+        if self.timeline:
+            sample['heap_fragments'] = sum(
+                list(self.cdp.heap_fragments.values()))
+        else:
+            try:
+                sample['heap_usage'] = self.cdp.get_heap_usage()
+            except (pychrome.CallMethodException, pychrome.TimeoutException):
+                sample['heap_usage'] = None
+        sample['requests'] = len(self.cdp.requests[0])
+        if self._performance:
+            try:
+                metrics = self.cdp.tab.Performance.getMetrics()['metrics']
+            except (pychrome.CallMethodException, pychrome.TimeoutException):
+                metrics = []
+            for metric in metrics:
+                sample[metric['name']] = metric['value']
+        length = len(self.columns['time'])
+        for name, value in sample.items():
+            self.columns.setdefault(name, [None] * length).append(value)
+        for column in self.columns.values():
+            if len(column) == length:
+                column.append(None)
+        _last_sample.clear()
+        _last_sample.update(sample, test=self.cdp.name)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    """
+    Отдача последнего среза телеметрии в формате prometheus
+    """
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        sample = dict(_last_sample)
+        test = sample.pop('test', '')
+        lines = ['sealant_{0}{{test="{1}"}} {2}'.format(name, test, value)
+                 for name, value in sample.items() if value is not None]
+        body = '\n'.join(lines).encode('utf-8') + b'\n'
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_metrics_server(port=conf.telemetry_port):
+    """
+    Запуск http сервера /metrics на localhost. Сервер один на процесс и
+    работает до его завершения.
+    :param port: порт сервера
+    """
+    global _metrics_server
+    if _metrics_server is None:
+        _metrics_server = HTTPServer(('localhost', int(port)), _MetricsHandler)
+        thread = threading.Thread(target=_metrics_server.serve_forever,
+                                  daemon=True)
+        thread.start()
+        log('Телеметрия доступна на http://localhost:{}/metrics'.format(port))
+    return True
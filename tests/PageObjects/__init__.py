@@ -1,3 +1,3 @@
 # coding=utf-8
 
-from tests.PageObjects.page import MainPage
+from tests.PageObjects.page import ContextPage, MainPage
@@ -23,3 +23,31 @@ class MainPage(BasePage):
         element = self.driver.find_element(*MainPageLocators.NO_LEAK)
         element.click()
         print("Не создается утечка")
+
+
+class ContextPage(object):
+    """Класс страницы во вкладке изолированного контекста браузера.
+    Вкладка контекста не управляется selenium, действия выполняются
+    через подключение к ней self.cdp"""
+
+    def __init__(self, cdp):
+        self.cdp = cdp
+
+    def click(self, locator):
+        """Нажатие на элемент по id после загрузки страницы"""
+        self.cdp.tab.Runtime.evaluate(
+            expression="new Promise(resolve => document.readyState == "
+                       "'complete' ? resolve() : addEventListener('load', "
+                       "resolve)).then(() => document.getElementById('{}')"
+                       ".click())".format(locator[1]),
+            awaitPromise=True)
+
+    def click_leak_button(self):
+        """Нажатие на кнопку с созданием утечки"""
+        self.click(MainPageLocators.LEAK)
+        print('Создана утечка +1МБ (+1 DOM, +1 listener)')
+
+    def click_no_leak_button(self):
+        """Нажатие на кнопку без создания утечки"""
+        self.click(MainPageLocators.NO_LEAK)
+        print("Не создается утечка")
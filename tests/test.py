@@ -10,25 +10,33 @@ from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
 
 from sealant import sealant
-from tests.PageObjects.page import MainPage
+from sealant.config import SeaLantConfig
+from tests.PageObjects.page import ContextPage, MainPage
+
+
+def start_chrome():
+    """Запуск Chrome с портом отладки 9222"""
+    binary = r'.\bin\chromedriver'
+    options = Options()
+    options.add_argument("--disable-gpu")
+    options.add_argument("--remote-debugging-port=9222")
+    options.add_argument("--headless")
+    options.add_argument("--proxy-bypass-list=*")
+    options.add_argument("--proxy-server='direct://'")
+    options.add_argument("--incognito")
+    options.add_argument("--start-maximized")
+    options.add_argument("--window-size=1920,1080")
+    return webdriver.Chrome(executable_path=binary, options=options)
 
 
 class TestsCaseExample(TestCase):
 
     @classmethod
     def setUpClass(cls):
-        binary = r'.\bin\chromedriver'
-        options = Options()
-        options.add_argument("--disable-gpu")
-        options.add_argument("--remote-debugging-port=9222")
-        options.add_argument("--headless")
-        options.add_argument("--proxy-bypass-list=*")
-        options.add_argument("--proxy-server='direct://'")
-        options.add_argument("--incognito")
-        options.add_argument("--start-maximized")
-        options.add_argument("--window-size=1920,1080")
-        cls.driver = webdriver.Chrome(executable_path=binary, options=options)
-        cls.driver.get(url='file:///'+getcwd()+'/index.html')
+        url = 'file:///'+getcwd()+'/index.html'
+        cls.driver = start_chrome()
+        cls.driver.get(url=url)
+        SeaLantConfig.context_url = url
 
     def setUp(self):
         self.page = MainPage(self.driver)
@@ -43,6 +51,11 @@ class TestsCaseExample(TestCase):
         """Есть утечка, замер снэпшотом"""
         self.page.click_leak_button()
 
+    @sealant(timeline=False, hybrid=True)
+    def test_leak_hybrid(self):
+        """Есть утечка, замер гибридным режимом снэпшотов"""
+        self.page.click_leak_button()
+
     @sealant(timeline=True)
     def test_no_leak_timeline(self):
         """Нет утечки, замер таймлайном"""
@@ -53,6 +66,18 @@ class TestsCaseExample(TestCase):
         """Нет утечки, замер снэпшотом"""
         self.page.click_no_leak_button()
 
+    @sealant(timeline=False, isolate=True)
+    def test_leak_isolated(self):
+        """Есть утечка, замер снэпшотом в отдельном контексте браузера.
+        Вкладка контекста (self.cdp.context.target_id) не управляется
+        selenium, поэтому действия выполняются через self.cdp"""
+        ContextPage(self.cdp).click_leak_button()
+
+    @sealant(timeline=False, isolate=True)
+    def test_no_leak_isolated(self):
+        """Нет утечки, замер снэпшотом в отдельном контексте браузера"""
+        ContextPage(self.cdp).click_no_leak_button()
+
     def test_no_checking_leak(self):
         """Есть утечка, нет замера"""
         self.page.click_leak_button()
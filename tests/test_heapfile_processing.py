@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+Расчет heap файлов без подключения к ноде
+"""
+
+import os
+import shutil
+import tempfile
+import zipfile
+from unittest import TestCase, main
+
+from sealant.errors import NoTimeStepError
+from sealant.heapfile_processing import HeapObject
+from sealant.logger import set_logger
+
+
+class TestsLeakSizeBoundaries(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        set_logger()
+
+    def setUp(self):
+        self.heap = HeapObject('')
+        self.boundaries = [100, 200, 300, 400]
+
+    def test_boundaries(self):
+        """Объекты распределяются по шагам по id, первый шаг отбрасывается"""
+        self.heap.nodes = {50: 1000,    # до первой границы
+                           150: 1000,   # первый шаг
+                           201: 3000,   # второй шаг
+                           350: 5000,   # третий шаг
+                           401: 9000}   # после последней границы
+        self.assertEqual(self.heap.get_leak_size(boundaries=self.boundaries),
+                         [3.0, 5.0])
+
+    def test_id_equal_to_boundary(self):
+        """Объект с id, равным границе, относится к шагу, который она
+        завершает"""
+        self.heap.nodes = {100: 7000, 200: 2000, 300: 4000, 400: 6000}
+        self.assertEqual(self.heap.get_leak_size(boundaries=self.boundaries),
+                         [4.0, 6.0])
+
+    def test_not_enough_boundaries(self):
+        """Для расчета нужно не менее трех шагов"""
+        self.heap.nodes = {150: 1000}
+        with self.assertRaises(NoTimeStepError):
+            self.heap.get_leak_size(boundaries=[100, 200, 300])
+
+    def test_invalid_boundaries(self):
+        """Нулевые и невозрастающие границы не принимаются"""
+        self.heap.nodes = {i: 100000 for i in range(1, 100)}
+        for boundaries in ([0] * 6, [0, 10, 20, 30], [10, 20, 20, 30],
+                           [10, 30, 20, 40]):
+            with self.assertRaises(NoTimeStepError):
+                self.heap.get_leak_size(boundaries=boundaries)
+
+
+class TestsHeapGraph(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        set_logger()
+        cls.dir = tempfile.mkdtemp()
+        archive = os.path.join(os.path.dirname(__file__), 'leaks',
+                               'test_leak_timeline.zip')
+        with zipfile.ZipFile(archive) as file:
+            file.extractall(cls.dir)
+        cls.base = HeapObject(os.path.join(cls.dir, '15_27_34.heaptimeline'))
+        cls.base.parsing_heap_file(with_names=True)
+        cls.heap = HeapObject(os.path.join(cls.dir, '15_28_29.heaptimeline'))
+        cls.heap.parsing_heap_file(with_names=True, with_graph=True)
+        cls.graph = cls.heap.graph
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.dir)
+
+    def test_objects_by_name(self):
+        """Объекты находятся по имени конструктора"""
+        ids = self.graph.objects_by_name('HTMLDivElement')
+        self.assertEqual(len(ids), 28)
+        self.assertEqual({self.heap.names[node_id] for node_id in ids},
+                         {'HTMLDivElement'})
+
+    def test_retainer_path(self):
+        """Путь удержания от GC roots до объекта"""
+        node_id = self.graph.objects_by_name('HTMLDivElement')[0]
+        self.assertEqual(self.graph.retainer_path(node_id),
+                         '(GC roots)[13] -> (Global handles).49 -> '
+                         'HTMLDivElement')
+        self.assertIsNone(self.graph.retainer_path(-1))
+
+    def test_retainers(self):
+        """Обратный индекс содержит ребро пути удержания"""
+        index = self.graph.index_by_id[
+            self.graph.objects_by_name('HTMLDivElement')[0]]
+        self.graph.retainer_path(0)
+        parent = (self.graph.parent_node[index], self.graph.parent_edge[index])
+        self.assertIn(parent, self.graph.retainers(index))
+
+    def test_retainer_paths_dedup(self):
+        """Пути, отличающиеся индексами элементов, схлопываются"""
+        strings = [node_id for node_id in self.heap.nodes
+                   if node_id not in self.base.nodes and
+                   self.heap.names[node_id] == '(string)']
+        self.assertEqual(len(strings), 7)
+        self.assertEqual(len({self.graph.retainer_path(node_id)
+                              for node_id in strings}), 7)
+        paths = self.heap.get_retainer_paths(strings)
+        self.assertEqual(len(paths), 1)
+        self.assertRegex(paths[0],
+                         r'^Window / file://\.x -> Array\[\d+\] -> \(string\)$')
+
+
+if __name__ == '__main__':
+    main()
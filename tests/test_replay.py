@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+Воспроизведение записанной сессии CDP через заглушку ноды без Chrome
+"""
+
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase, main
+
+from pychrome import CallMethodException, TimeoutException
+
+from sealant import sealant
+from sealant.benchmark import benchmark
+from sealant.cdp import DevToolsProtocolConnection
+from sealant.cdp_replay import CdpStubServer, load_record
+from sealant.config import SeaLantConfig
+from sealant.logger import set_logger
+
+HEAP_FILE = json.dumps({
+    'snapshot': {'meta': {
+        'node_fields': ['type', 'name', 'id', 'self_size', 'edge_count',
+                        'trace_node_id'],
+        'node_types': [['hidden', 'object', 'string'], 'string', 'number',
+                       'number', 'number', 'number'],
+        'edge_fields': ['type', 'name_or_index', 'to_node'],
+        'edge_types': [['context', 'element', 'property', 'internal',
+                        'hidden', 'shortcut', 'weak'], 'string_or_number',
+                       'node']}},
+    'nodes': [0, 0, 1, 0, 1, 0,
+              1, 1, 3, 2048, 0, 0],
+    'edges': [2, 2, 6],
+    'samples': [],
+    'strings': ['', 'Object', 'x']})
+
+HEAP_USAGE = {'usedSize': 2048000, 'totalSize': 4096000}
+SNAPSHOT_CHUNKS = [('HeapProfiler.addHeapSnapshotChunk',
+                    {'chunk': HEAP_FILE[:20]}),
+                   ('HeapProfiler.addHeapSnapshotChunk',
+                    {'chunk': HEAP_FILE[20:]})]
+SETTLE = [('Runtime.getHeapUsage', HEAP_USAGE, []),
+          ('HeapProfiler.collectGarbage', {}, []),
+          ('Runtime.getHeapUsage', HEAP_USAGE, [])]
+
+
+def make_record(calls):
+    """
+    Запись сессии по списку вызовов
+    :param calls: список (метод, результат, события перед ответом)
+    :return: список [время, "send"/"recv", сообщение]
+    """
+    record = []
+    for i, (method, result, events) in enumerate(calls):
+        record.append([i * 0.01, 'send', {'id': 1001 + i, 'method': method,
+                                          'params': {}}])
+        for event, params in events:
+            record.append([i * 0.01, 'recv', {'method': event,
+                                              'params': params}])
+        record.append([i * 0.01, 'recv', {'id': 1001 + i, 'result': result}])
+    return record
+
+
+RECORD = make_record([
+    ('HeapProfiler.enable', {}, []),
+    ('Runtime.getHeapUsage', HEAP_USAGE, []),
+    ('HeapProfiler.takeHeapSnapshot', {}, SNAPSHOT_CHUNKS)])
+
+
+class TestsCdpReplay(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        set_logger()
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.dir = tempfile.mkdtemp()
+        os.chdir(self.dir)
+        self.conf = {name: getattr(SeaLantConfig, name) for name in
+                     ('cdp_record', 'path_to_save', 'number_of_test_repeats',
+                      'metrics')}
+        SeaLantConfig.path_to_save = self.dir + '/'
+        self.record_file = self.write_record(RECORD)
+
+    def tearDown(self):
+        for name, value in self.conf.items():
+            setattr(SeaLantConfig, name, value)
+        os.chdir(self.cwd)
+        shutil.rmtree(self.dir)
+
+    def write_record(self, record, name='record'):
+        """Сохранение записи в файл"""
+        record_file = os.path.join(self.dir, name + '.jsonl')
+        with open(record_file, 'w', encoding='utf-8') as file:
+            for item in record:
+                file.write(json.dumps(item) + '\n')
+        return record_file
+
+    def _replay(self, record_file, name):
+        """Прогон сессии записи через заглушку"""
+        stub = CdpStubServer(record_file, speed=0)
+        stub.start()
+        cdp = DevToolsProtocolConnection()
+        cdp.name = name
+        try:
+            cdp.connect_to_node('http://localhost', stub.port)
+            cdp.tab.HeapProfiler.enable()
+            self.assertEqual(cdp.get_heap_usage(), 2048)
+            heap_file_name = cdp.get_heap_file(timeline=False)
+        finally:
+            if cdp.started:
+                cdp.disconnect_from_node()
+            stub.stop()
+        with open(heap_file_name) as file:
+            self.assertEqual(file.read(), HEAP_FILE)
+
+    def test_replay(self):
+        """Ответы и чанки heapfile воспроизводятся по записи"""
+        self._replay(self.record_file, 'test_replay')
+
+    def test_record_and_replay(self):
+        """Запись сессии через заглушку воспроизводится повторно"""
+        SeaLantConfig.cdp_record = True
+        self._replay(self.record_file, 'recorded')
+        SeaLantConfig.cdp_record = False
+        recorded = os.path.join(self.dir, 'cdp_records', 'recorded.jsonl')
+        methods = [item[2]['method'] for item in load_record(recorded)
+                   if item[1] == 'send']
+        self.assertEqual(methods, [item[2]['method'] for item in RECORD
+                                   if item[1] == 'send'])
+        self._replay(recorded, 'replayed')
+
+    def test_heap_boundary(self):
+        """Граница шага берется из второго нового события lastSeenObjectId"""
+        record = make_record([('HeapProfiler.startTrackingHeapObjects', {},
+                               [])])
+        record += [[0.2 * i, 'recv', {
+            'method': 'HeapProfiler.lastSeenObjectId',
+            'params': {'lastSeenObjectId': 100 * i, 'timestamp': i}}]
+            for i in range(1, 5)]
+        stub = CdpStubServer(self.write_record(record, name='boundary'),
+                             speed=1)
+        stub.start()
+        cdp = DevToolsProtocolConnection()
+        try:
+            cdp.connect_to_node('http://localhost', stub.port)
+            with self.assertRaises(CallMethodException):
+                cdp.get_heap_boundary()
+            cdp.start_heap_tracking()
+            self.assertEqual(cdp.get_heap_boundary(), 200)
+            self.assertEqual(cdp.get_heap_boundary(), 400)
+            with self.assertRaises(TimeoutException):
+                cdp.get_heap_boundary(timeout=0.5)
+        finally:
+            if cdp.started:
+                cdp.disconnect_from_node()
+            stub.stop()
+
+    def test_benchmark(self):
+        """Этапы конвейера проходят на записи с сетевыми событиями"""
+        record_file = self.write_record(make_record([
+            ('Network.enable', {}, [
+                ('Network.requestWillBeSent',
+                 {'requestId': '1', 'request': {'headers': {}}}),
+                ('Network.loadingFinished', {'requestId': '1'})]),
+            ('HeapProfiler.takeHeapSnapshot', {}, SNAPSHOT_CHUNKS)]),
+            name='benchmark')
+        stages = benchmark(record_file, speed=0, time_after_last_resp=0.5)
+        self.assertEqual(list(stages), ['connect', 'wait', 'capture', 'parse',
+                                        'leak_size'])
+        self.assertGreaterEqual(stages['wait'], 0.5)
+        self.assertFalse(os.path.exists('heapsnapshots/benchmark'))
+
+    def test_decorator_hybrid(self):
+        """Тест с декоратором в гибридном режиме без утечки"""
+        SeaLantConfig.number_of_test_repeats = 3
+        SeaLantConfig.metrics = ()
+        stub = CdpStubServer(self.write_record(make_record(
+            [('HeapProfiler.enable', {}, [])] + SETTLE +
+            [('HeapProfiler.takeHeapSnapshot', {}, SNAPSHOT_CHUNKS)] +
+            SETTLE * 3 +
+            [('HeapProfiler.takeHeapSnapshot', {}, SNAPSHOT_CHUNKS)]),
+            name='hybrid'), speed=0)
+        stub.start()
+        steps = []
+
+        @sealant(timeline=False, hybrid=True, wait_func=False,
+                 host='http://localhost', port=stub.port)
+        def test_case():
+            steps.append(1)
+
+        try:
+            test_case()
+        finally:
+            stub.stop()
+        cdp = test_case.__wrapped__.cdp
+        self.assertEqual(len(steps), 4)
+        self.assertEqual(cdp.gc_rounds, [1, 1, 1, 1])
+        self.assertFalse(cdp.started)
+
+
+if __name__ == '__main__':
+    main()